@@ -0,0 +1,42 @@
+#!/usr/bin/env bash
+# Per-call timing of opwrap against stub op/sops with emulated latency.
+#
+#   tests/opwrap/bench.sh                  # pre-check vs lazy vs agent
+#   BASELINE=/tmp/opwrap.old tests/opwrap/bench.sh
+#
+# BASELINE is any other opwrap to time alongside, e.g. the pre-agent version:
+#   git show <rev>:opwrap > /tmp/opwrap.old
+set -euo pipefail
+source "$(dirname "${BASH_SOURCE[0]}")/common.sh"
+
+export SOPS_DELAY="${SOPS_DELAY:-0.1}" OP_DELAY="${OP_DELAY:-0.15}"
+CALLS="${CALLS:-10}"
+
+# Prints mean ms per `vault list` call. The whole loop runs in one child so a
+# wrapper such as with_tty is paid once rather than per call.
+bench() {
+  local label=$1 script=$2 start end
+  shift 2
+  start=$(python3 -c 'import time; print(time.monotonic())')
+  "$@" bash -c 'for (( i = 0; i < $1; i++ )); do bash "$0" vault list >/dev/null; done' "$script" "$CALLS"
+  end=$(python3 -c 'import time; print(time.monotonic())')
+  python3 -c 'import sys; print(f"{sys.argv[1]:<22}{(float(sys.argv[3]) - float(sys.argv[2])) * 1000 / int(sys.argv[4]):6.0f} ms/call")' \
+    "$label" "$start" "$end" "$CALLS"
+}
+
+echo "stub sops ${SOPS_DELAY}s, stub op ${OP_DELAY}s, mean of $CALLS calls"
+
+if [[ -n "${BASELINE:-}" ]]; then
+  reset_stubs
+  bash "$BASELINE" vault list </dev/null >/dev/null
+  bench "baseline" "$BASELINE" </dev/null
+fi
+
+reset_stubs
+bash "$OPWRAP" vault list </dev/null >/dev/null
+bench "pre-check (piped)" "$OPWRAP" </dev/null
+bench "lazy validation" "$OPWRAP" with_tty
+
+export OPWRAP_AGENT=1
+with_tty bash "$OPWRAP" vault list >/dev/null
+bench "agent mode (warm)" "$OPWRAP" with_tty
@@ -0,0 +1,28 @@
+# Shared setup for the opwrap tests and benchmark: stub op/sops on PATH and a
+# throwaway cache dir. Source it, then call `reset_stubs` before each case.
+HERE="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+OPWRAP="$HERE/../../opwrap"
+WORK="$(mktemp -d)"
+trap 'OPWRAP_AGENT=1 bash "$OPWRAP" --stop-agent 2>/dev/null; rm -rf "$WORK"' EXIT
+
+export PATH="$HERE/bin:$PATH"
+export XDG_CACHE_HOME="$WORK/cache"
+export STUB_STATE="$WORK/state"
+export STUB_LOG="$WORK/log"
+CACHE_DIR="$XDG_CACHE_HOME/wrapper-1password"
+
+reset_stubs() {
+  OPWRAP_AGENT=1 bash "$OPWRAP" --stop-agent 2>/dev/null || true
+  rm -rf "$XDG_CACHE_HOME" "$STUB_STATE"
+  mkdir -p "$STUB_STATE"
+  : > "$STUB_LOG"
+}
+
+# Runs a command with a pseudo-terminal on stdin, like an interactive shell
+with_tty() {
+  python3 -c '
+import os, pty, subprocess, sys
+master, slave = pty.openpty()
+sys.exit(subprocess.call(sys.argv[1:], stdin=slave))
+' "$@"
+}
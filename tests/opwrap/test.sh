@@ -0,0 +1,184 @@
+#!/usr/bin/env bash
+# Behaviour tests for opwrap against stub op and sops. Run: tests/opwrap/test.sh
+set -uo pipefail
+source "$(dirname "${BASH_SOURCE[0]}")/common.sh"
+
+FAILED=0
+
+check() {
+  local name=$1; shift
+  if "$@"; then
+    echo "ok   $name"
+  else
+    echo "FAIL $name"
+    FAILED=1
+  fi
+}
+
+count() {
+  grep -c "^$1" "$STUB_LOG" || true
+}
+
+expire_session() {
+  rm -f "$STUB_STATE/session"
+  : > "$STUB_LOG"
+}
+
+for mode in 0 1; do
+  export OPWRAP_AGENT=$mode
+  echo "# OPWRAP_AGENT=$mode"
+
+  reset_stubs
+  out="$(with_tty bash "$OPWRAP" item get "a b")"
+  check "first call signs in and keeps spaced args" \
+    test "$out" == "ran: item get a b" -a "$(count signin)" == 1
+
+  : > "$STUB_LOG"
+  out="$(with_tty bash "$OPWRAP" vault list)"
+  expected_sops=1
+  (( mode )) && expected_sops=0
+  check "warm call skips the pre-check" \
+    test "$out" == "ran: vault list" -a "$(count 'op list')" == 0 \
+      -a "$(count signin)" == 0 -a "$(count sops)" == "$expected_sops"
+
+  with_tty bash "$OPWRAP" fail >/dev/null 2>"$WORK/err"
+  status=$?
+  check "failing command keeps stderr and exit code" \
+    test "$status" == 3 -a "$(cat "$WORK/err")" == "boom"
+
+  expire_session
+  out="$(with_tty bash "$OPWRAP" vault list 2>"$WORK/err")"
+  check "expired session signs in once and retries" \
+    test "$out" == "ran: vault list" -a "$(count signin)" == 1 -a ! -s "$WORK/err"
+
+  : > "$STUB_LOG"
+  : > "$WORK/effects"
+  with_tty bash "$OPWRAP" run -- sh -c \
+    'echo X >> "$0"; echo "error: authentication required" >&2; exit 3' \
+    "$WORK/effects" 2>"$WORK/err"
+  status=$?
+  check "op run child stderr is not mistaken for expiry" \
+    test "$status" == 3 -a "$(count signin)" == 0 -a "$(wc -l < "$WORK/effects")" -eq 1 \
+      -a "$(cat "$WORK/err")" == "error: authentication required"
+
+  with_tty bash "$OPWRAP" run -- sh -c 'echo progress >&2; sleep 0.1; echo done' \
+    > "$WORK/both" 2>&1
+  check "op run stderr is streamed in order" \
+    test "$(tr '\n' ' ' < "$WORK/both")" == "progress done "
+
+  expire_session
+  out="$(echo TEMPLATE | bash "$OPWRAP" inject)"
+  check "piped stdin survives an expired session" \
+    test "$out" == "injected: TEMPLATE" -a "$(count signin)" == 1
+
+  expire_session
+  export SIGNIN_DELAY=0.5
+  for i in 1 2 3 4 5 6 7 8; do
+    with_tty bash "$OPWRAP" item "$i" >/dev/null 2>&1 &
+  done
+  wait
+  unset SIGNIN_DELAY
+  check "concurrent callers share one sign-in" test "$(count signin)" == 1
+
+  check "session token never appears in op's argv" eval '! grep -q tok- "$STUB_LOG"'
+done
+unset OPWRAP_AGENT
+
+now() {
+  python3 -c 'import time; print(time.monotonic())'
+}
+
+# Pre-agent lock layout: a signin.lock whose pid has exited
+dead_pid() {
+  sh -c 'exit 0' &
+  echo $!
+  wait
+}
+
+reset_stubs
+bash "$OPWRAP" vault list </dev/null >/dev/null
+mkdir "$CACHE_DIR/signin.lock" "$CACHE_DIR/signin.lock.break"
+dead_pid > "$CACHE_DIR/signin.lock/pid"
+dead_pid > "$CACHE_DIR/signin.lock.break/pid"
+expire_session
+OPWRAP_LOCK_TIMEOUT=3 with_tty bash "$OPWRAP" vault list >"$WORK/out" 2>/dev/null
+check "leftover .break from a dead breaker is cleared" \
+  test "$?" == 0 -a "$(cat "$WORK/out")" == "ran: vault list" -a ! -e "$CACHE_DIR/signin.lock.break"
+
+mkdir "$CACHE_DIR/signin.lock" "$CACHE_DIR/signin.lock.break"
+dead_pid > "$CACHE_DIR/signin.lock/pid"
+touch -t 202001010000 "$CACHE_DIR/signin.lock.break"
+expire_session
+OPWRAP_LOCK_TIMEOUT=3 with_tty bash "$OPWRAP" vault list >"$WORK/out" 2>/dev/null
+check "old .break without a pid file is cleared" \
+  test "$?" == 0 -a "$(cat "$WORK/out")" == "ran: vault list"
+
+mkdir "$CACHE_DIR/signin.lock"
+touch -t 202001010000 "$CACHE_DIR/signin.lock"
+expire_session
+OPWRAP_LOCK_TIMEOUT=3 with_tty bash "$OPWRAP" vault list >"$WORK/out" 2>/dev/null
+check "old lock without a pid file is broken" \
+  test "$?" == 0 -a "$(cat "$WORK/out")" == "ran: vault list" -a "$(count signin)" == 1
+
+mkdir "$CACHE_DIR/signin.lock.break"
+echo $$ > "$CACHE_DIR/signin.lock.break/pid"
+mkdir "$CACHE_DIR/signin.lock"
+dead_pid > "$CACHE_DIR/signin.lock/pid"
+expire_session
+start=$(now)
+OPWRAP_LOCK_TIMEOUT=1 with_tty bash "$OPWRAP" vault list >/dev/null 2>"$WORK/err"
+status=$?
+elapsed=$(python3 -c "print(int($(now) - $start))")
+rm -rf "$CACHE_DIR/signin.lock" "$CACHE_DIR/signin.lock.break"
+check "busy .break still honours the lock timeout" \
+  eval 'test "$status" == 1 -a "$elapsed" -lt 5 && grep -q "gave up" "$WORK/err"'
+
+reset_stubs
+bash "$OPWRAP" vault list </dev/null >/dev/null
+mkdir "$CACHE_DIR/signin.lock"
+sh -c 'exit 0' &
+echo $! > "$CACHE_DIR/signin.lock/pid"
+wait
+expire_session
+out="$(with_tty bash "$OPWRAP" vault list 2>/dev/null)"
+check "stale lock from a dead process is broken" \
+  test "$out" == "ran: vault list" -a "$(count signin)" == 1
+
+sleep 30 &
+holder=$!
+mkdir "$CACHE_DIR/signin.lock"
+echo "$holder" > "$CACHE_DIR/signin.lock/pid"
+expire_session
+OPWRAP_LOCK_TIMEOUT=2 with_tty bash "$OPWRAP" vault list >/dev/null 2>"$WORK/err"
+status=$?
+kill "$holder"
+rm -rf "$CACHE_DIR/signin.lock"
+check "live lock holder gets a notice and a timeout" \
+  eval 'test "$status" == 1 && grep -q "waiting for sign-in" "$WORK/err" && grep -q "gave up" "$WORK/err"'
+
+reset_stubs
+: > "$STUB_LOG"
+with_tty bash "$OPWRAP" signin >/dev/null
+check "signin is passed straight to op" \
+  test "$(count signin)" == 1 -a "$(count sops)" == 0
+
+# Unix socket paths are limited to ~104 bytes, so the agent can't bind here
+long="$WORK/$(printf 'x%.0s' {1..120})"
+mkdir -p "$long"
+: > "$STUB_LOG"
+XDG_CACHE_HOME="$long" OPWRAP_AGENT=1 with_tty bash "$OPWRAP" vault list >/dev/null 2>/dev/null
+start=$(now)
+XDG_CACHE_HOME="$long" OPWRAP_AGENT=1 with_tty bash "$OPWRAP" vault list >"$WORK/out" 2>"$WORK/err"
+status=$?
+elapsed=$(python3 -c "print($(now) - $start < 1)")
+check "agent that can't start falls back quickly with a warning" \
+  eval 'test "$status" == 0 -a "$elapsed" == True -a "$(cat "$WORK/out")" == "ran: vault list" && grep -q "could not start the session agent" "$WORK/err"'
+
+reset_stubs
+mkdir -p "$CACHE_DIR"
+chmod 755 "$CACHE_DIR"
+with_tty bash "$OPWRAP" vault list >/dev/null
+check "existing cache dir is tightened to 0700" \
+  test "$(ls -ld "$CACHE_DIR" | cut -c1-10)" == "drwx------"
+
+exit "$FAILED"